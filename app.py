@@ -1,141 +1,240 @@
+import hashlib
+import os
+import re
+import zipfile
 import streamlit as st
 import pandas as pd
 import numpy as np
+import xlsxwriter
 from io import BytesIO
-
-st.title("Financial Accounts Consolidation using IND AS 21")
-
-st.header("Upload Excel Files")
-
-# Upload parent company Excel file
-parent_file = st.file_uploader("Upload Parent Company Excel File", type=['xlsx'], key='parent')
-
-# Upload subsidiary companies' Excel files
-subsidiary_files = st.file_uploader(
-    "Upload Subsidiary Company Excel Files",
-    type=['xlsx'],
-    accept_multiple_files=True,
-    key='subsidiaries'
-)
-
-if parent_file is not None and subsidiary_files:
-    st.header("Processing and Consolidating Data...")
-
-    # Read parent company Excel file
-    parent_excel = pd.ExcelFile(parent_file)
-    parent_sheets = parent_excel.sheet_names
-    parent_data = {}
-    for sheet in parent_sheets:
-        df = parent_excel.parse(sheet)
-        parent_data[sheet] = df
-
-    # Read subsidiary companies' Excel files
-    subsidiaries_data = {}
-    for file in subsidiary_files:
-        sub_name = file.name
-        st.write(f"Processing subsidiary: {sub_name}")
-        sub_excel = pd.ExcelFile(file)
-        sub_sheets = sub_excel.sheet_names
-        sub_data = {}
-        for sheet in sub_sheets:
-            df = sub_excel.parse(sheet)
-            sub_data[sheet] = df
-        subsidiaries_data[sub_name] = sub_data
-
-    # Collect ownership percentages for each subsidiary
-    st.header("Enter Ownership Percentages for Subsidiaries")
-    ownership_percentages = {}
-    for file in subsidiary_files:
-        sub_name = file.name
-        ownership = st.number_input(
-            f"Ownership percentage of {sub_name} (%)",
-            min_value=0.0,
-            max_value=100.0,
-            value=100.0,
-            key=f"ownership_{sub_name}"
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import reduce
+from importlib.util import find_spec
+
+# Copy-on-write lets reindex/set_index/slicing share buffers instead of copying
+# eagerly. It is always on from pandas 3, where the option is deprecated
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Prefer the Rust-based calamine reader; fall back to openpyxl when it's missing
+EXCEL_ENGINE = 'calamine' if find_spec('python_calamine') else 'openpyxl'
+
+# Rows mentioning inter-company balances are eliminated on consolidation
+INTERCOMPANY_RE = re.compile(r'Inter[- ]?company|\bIC\b', re.IGNORECASE)
+
+
+@st.cache_data(show_spinner=False)
+def read_workbook(file_bytes: bytes) -> dict[str, pd.DataFrame]:
+    # Parse every sheet of an uploaded workbook; cached on the file bytes so
+    # widget-triggered reruns don't re-read the same upload. Columns are
+    # converted to Arrow-backed dtypes (pyarrow ships with streamlit) for cheaper
+    # key hashing and concat. Converting after the parse, rather than parsing
+    # with dtype_backend='pyarrow', keeps columns mixing numbers and text as object
+    excel = pd.ExcelFile(BytesIO(file_bytes), engine=EXCEL_ENGINE)
+    return {
+        sheet: excel.parse(sheet).convert_dtypes(dtype_backend='pyarrow') for sheet in excel.sheet_names
+    }
+
+
+def sum_by_keys(df: pd.DataFrame, keys: list[str]) -> pd.DataFrame:
+    # Trial balances usually already have one row per key; those only need
+    # indexing (sorted, to match groupby's order) instead of a grouped sum
+    if df[keys].notna().all(axis=None):
+        indexed = df.set_index(keys)
+        if indexed.index.is_unique:
+            return indexed.sort_index()
+    return df.groupby(keys).sum()
+
+
+def weighted_block(agg: pd.DataFrame, columns: list[str], weight: float = 1.0) -> np.ndarray:
+    # Gather the columns into a single float64 block in the requested order and
+    # apply the weight; columns the frame lacks stay zero. Blank cells count as
+    # zero, as in groupby's sum, so they can't turn a weighted total NaN. The
+    # weight isn't applied in place: to_numpy may return a read-only view of the
+    # frame's own buffer under copy-on-write
+    block = np.zeros((len(agg), len(columns)))
+    positions = agg.columns.get_indexer(columns)
+    present = positions >= 0
+    values = agg.iloc[:, positions[present]].to_numpy(dtype=np.float64, na_value=0.0)
+    block[:, present] = values * weight
+    return block
+
+
+def consolidate_sheet(
+    parent_df: pd.DataFrame, sub_frames: list[pd.DataFrame], weights: list[float]
+) -> pd.DataFrame:
+    # Consolidate one sheet: the parent's rows plus each subsidiary's rows
+    # scaled by its ownership weight, summed per key, with inter-company rows
+    # eliminated
+
+    # Identify key column(s) for grouping
+    possible_keys = ['Account Code', 'Account Name', 'GL Code']
+    key_cols = [col for col in possible_keys if col in parent_df.columns]
+
+    # A header-only parent sheet reads back with object columns; treat a column
+    # as numeric when the subsidiaries fill it with numbers, so their values
+    # are still weighted by ownership
+    blank_cols = [col for col in parent_df.columns[parent_df.isna().all()] if col not in key_cols]
+    numeric_blank = [
+        col for col in blank_cols
+        if any(col in sub_df.columns for sub_df in sub_frames)
+        and all(pd.api.types.is_numeric_dtype(sub_df[col]) for sub_df in sub_frames if col in sub_df.columns)
+    ]
+    if numeric_blank:
+        parent_df = parent_df.astype(dict.fromkeys(numeric_blank, 'float64[pyarrow]'))
+
+    if key_cols:
+        group_by_cols = key_cols
+    else:
+        # Use all non-numeric columns as keys
+        group_by_cols = parent_df.select_dtypes(exclude=[np.number]).columns.tolist()
+
+    # Subsidiaries are aligned to the parent's columns, so its schema decides
+    # which value columns are numeric for every subsidiary on this sheet
+    value_cols = [col for col in parent_df.columns if col not in group_by_cols]
+    numeric_cols = [
+        col for col in parent_df.select_dtypes(include=[np.number]).columns if col not in group_by_cols
+    ]
+    # Keys and text columns are always aligned; numeric ones only if present
+    always_aligned = ~parent_df.columns.isin(numeric_cols)
+
+    # Align columns with parent_df. Numeric columns a subsidiary lacks are
+    # left out here and come back as zeros in its block
+    aligned_frames = [
+        sub_df.reindex(
+            columns=parent_df.columns[always_aligned | parent_df.columns.isin(sub_df.columns)], fill_value=0
         )
-        ownership_percentages[sub_name] = ownership / 100.0  # Convert to decimal
-
-    # Initialize consolidated data
-    consolidated_data = {}
-
-    # Get all sheets present in parent and subsidiaries
-    all_sheets = set(parent_sheets)
-    for sub_data in subsidiaries_data.values():
-        all_sheets.update(sub_data.keys())
-
-    for sheet in all_sheets:
-        # Initialize an empty DataFrame for this sheet
-        consolidated_df = pd.DataFrame()
-
-        # Process parent data
-        if sheet in parent_data:
-            parent_df = parent_data[sheet]
-            consolidated_df = parent_df.copy()
-
-        # Process subsidiary data
-        for sub_name, sub_data in subsidiaries_data.items():
-            if sheet in sub_data:
-                sub_df = sub_data[sheet].copy()
-
-                # Align columns with parent_df
-                sub_df = sub_df.reindex(columns=consolidated_df.columns, fill_value=0)
-
-                # Adjust for ownership percentage
-                numeric_cols = sub_df.select_dtypes(include=[np.number]).columns.tolist()
-                sub_df[numeric_cols] = sub_df[numeric_cols] * ownership_percentages[sub_name]
-
-                # Append to consolidated_df
-                consolidated_df = pd.concat([consolidated_df, sub_df], ignore_index=True)
-
+        for sub_df in sub_frames
+    ]
+
+    # Indexing by key and adding aligned frames sort the keys with '<', which
+    # fails on keys mixing numbers and text; groupby sorts those safely. So the
+    # indexed path is only taken when each key column has one non-object dtype,
+    # shared by the parent and every subsidiary
+    key_dtypes = parent_df.dtypes[group_by_cols]
+    indexed_keys = (key_dtypes != object).all() and all(
+        sub_df.dtypes[group_by_cols].equals(key_dtypes) for sub_df in aligned_frames
+    )
+
+    # Process subsidiary data, summing each subsidiary first so the
+    # ownership adjustment only touches one row per key
+    sub_aggs = [
+        sum_by_keys(sub_df, group_by_cols) if indexed_keys else sub_df.groupby(group_by_cols).sum()
+        for sub_df in aligned_frames
+    ]
+
+    all_numeric = len(numeric_cols) == len(value_cols)
+    same_keys = all(agg.index.equals(sub_aggs[0].index) for agg in sub_aggs)
+    weighted_aggs = []
+    if len(sub_aggs) > 1 and same_keys and all_numeric:
+        # Subsidiaries share the same keys and columns: stack them and apply
+        # every ownership weight in one fused scale-and-sum
+        stacked = np.stack([weighted_block(agg, numeric_cols) for agg in sub_aggs])
+        weighted = np.einsum('s,srk->rk', np.array(weights), stacked)
+        weighted_aggs.append(pd.DataFrame(weighted, index=sub_aggs[0].index, columns=numeric_cols))
+    else:
+        for agg, weight in zip(sub_aggs, weights):
+            # Scale the numeric block as one contiguous 2-D array, aligned to
+            # the parent's columns in the same pass
+            weighted_agg = agg.reindex(columns=value_cols)
+            weighted_agg[numeric_cols] = weighted_block(agg, numeric_cols, weight)
+            weighted_aggs.append(weighted_agg)
+
+    if all_numeric and indexed_keys:
+        # Every frame is now indexed by key, so add them with alignment
+        # instead of concatenating and grouping again
+        consolidated_df = reduce(
+            lambda acc, agg: acc.add(agg, fill_value=0),
+            weighted_aggs,
+            sum_by_keys(parent_df, group_by_cols),
+        )
+        consolidated_df = consolidated_df.sort_index().fillna(0).reset_index()
+    else:
+        # Text value columns need groupby's concatenating sum, and mixed keys
+        # its safe sort; concatenate once per sheet rather than growing the
+        # frame per subsidiary
+        frames = [parent_df, *(agg.reset_index() for agg in weighted_aggs)]
+        # Empty frames (a header-only parent) are left out, as pandas is
+        # deprecating their say in the concatenated dtypes
+        consolidated_df = pd.concat([df for df in frames if not df.empty] or frames, ignore_index=True)
         if not consolidated_df.empty:
-            # Identify key column(s) for grouping
-            possible_keys = ['Account Code', 'Account Name', 'GL Code']
-            key_cols = [col for col in possible_keys if col in consolidated_df.columns]
-            if key_cols:
-                group_by_cols = key_cols
+            consolidated_df = consolidated_df.groupby(group_by_cols).sum().reset_index()
+
+    if not consolidated_df.empty:
+        # Eliminate inter-company transactions, scanning the text columns
+        # one at a time (numeric cells can never match the pattern)
+        intercompany_filter = np.zeros(len(consolidated_df), dtype=bool)
+        for col in consolidated_df.select_dtypes(exclude=[np.number]).columns:
+            intercompany_filter |= consolidated_df[col].astype('string').str.contains(
+                INTERCOMPANY_RE, na=False
+            ).to_numpy(dtype=bool)
+        consolidated_df = consolidated_df.loc[~intercompany_filter]
+
+    return consolidated_df
+
+
+def write_workbook(sheets: dict[str, pd.DataFrame]) -> bytes:
+    # Stream rows into xlsxwriter's constant-memory mode so only one row is held
+    # at a time. pandas' to_excel writes column by column, which that mode
+    # can't accept, so rows are written directly
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(
+        output, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'}
+    )
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, df.columns.tolist(), header_format)
+        # Missing values become None, which xlsxwriter leaves as empty cells
+        cells = df.astype(object).where(df.notna(), None)
+        for row_num, row in enumerate(cells.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_num, 0, row)
+    workbook.close()
+    return output.getvalue()
+
+
+def write_columnar_archive(sheets: dict[str, pd.DataFrame], file_format: str) -> bytes:
+    # Parquet and Feather hold one table per file, so each sheet becomes its
+    # own file inside a zip. Both formats need string column names, and one
+    # type per column, so object columns mixing numbers and text are written
+    # as strings
+    output = BytesIO()
+    with zipfile.ZipFile(output, 'w') as archive:
+        for sheet_name, df in sheets.items():
+            df = df.rename(columns=str).reset_index(drop=True)
+            df = df.astype(dict.fromkeys(df.select_dtypes(include='object').columns, 'string'))
+            buffer = BytesIO()
+            if file_format == 'parquet':
+                df.to_parquet(buffer, compression='zstd', index=False)
             else:
-                # Use all non-numeric columns as keys
-                group_by_cols = consolidated_df.select_dtypes(exclude=[np.number]).columns.tolist()
-
-            # Sum numeric data
-            consolidated_df = consolidated_df.groupby(group_by_cols, as_index=False).sum()
-
-            # Eliminate inter-company transactions
-            intercompany_keywords = ['Intercompany', 'Inter-company', 'IC']
-            pattern = '|'.join(intercompany_keywords)
-            intercompany_filter = consolidated_df.apply(
-                lambda row: row.astype(str).str.contains(pattern, case=False, na=False).any(), axis=1
-            )
-            consolidated_df = consolidated_df[~intercompany_filter]
-
-            # Store the consolidated data for this sheet, rename 'H Ltd' to 'HC Ltd' if necessary
-            final_sheet_name = 'HC Ltd' if sheet == 'H Ltd' else sheet
-            consolidated_data[final_sheet_name] = consolidated_df
-
-    if consolidated_data:
+                df.to_feather(buffer)
+            archive.writestr(f"{sheet_name}.{file_format}", buffer.getvalue())
+    return output.getvalue()
+
+
+@st.fragment
+def download_section(consolidated_data: dict[str, pd.DataFrame]) -> None:
+    # Runs as a fragment, so switching the download format only reruns this
+    # section instead of the whole script. xlsx is slow to serialize, so it is
+    # only built when it's the chosen format
+    download_format = st.radio("Download format", ['xlsx', 'parquet', 'feather'], horizontal=True)
+    if download_format == 'xlsx':
         # Prepare consolidated Excel file for download
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            for sheet_name, df in consolidated_data.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-        processed_data = output.getvalue()
-
-        st.success("Consolidation Completed")
+        processed_data = write_workbook(consolidated_data)
         st.download_button(
             label="Download Consolidated Excel File",
             data=processed_data,
             file_name="Consolidated_Financial_Statements.xlsx"
         )
     else:
-        st.error("No data to consolidate.")
+        processed_data = write_columnar_archive(consolidated_data, download_format)
+        st.download_button(
+            label=f"Download Consolidated {download_format.title()} Files",
+            data=processed_data,
+            file_name=f"Consolidated_Financial_Statements_{download_format}.zip"
+        )
 
-else:
-    st.info("Please upload both parent and subsidiary company Excel files.")
-import streamlit as st
-import pandas as pd
-import numpy as np
-from io import BytesIO
 
 st.title("Financial Accounts Consolidation using IND AS 21")
 
@@ -153,116 +252,98 @@ subsidiary_files = st.file_uploader(
 )
 
 if parent_file is not None and subsidiary_files:
-    st.header("Processing and Consolidating Data...")
-
-    # Read parent company Excel file
-    parent_excel = pd.ExcelFile(parent_file)
-    parent_sheets = parent_excel.sheet_names
-    parent_data = {}
-    for sheet in parent_sheets:
-        df = parent_excel.parse(sheet)
-        parent_data[sheet] = df
-
-    # Read subsidiary companies' Excel files
-    subsidiaries_data = {}
-    for file in subsidiary_files:
-        sub_name = file.name
-        st.write(f"Processing subsidiary: {sub_name}")
-        sub_excel = pd.ExcelFile(file)
-        sub_sheets = sub_excel.sheet_names
-        sub_data = {}
-        for sheet in sub_sheets:
-            df = sub_excel.parse(sheet)
-            sub_data[sheet] = df
-        subsidiaries_data[sub_name] = sub_data
-
-    # Collect ownership percentages for each subsidiary
+    # Collect ownership percentages for each subsidiary. The inputs sit in a
+    # form so editing them doesn't rerun the consolidation until submitted
     st.header("Enter Ownership Percentages for Subsidiaries")
     ownership_percentages = {}
-    for file in subsidiary_files:
-        sub_name = file.name
-        ownership = st.number_input(
-            f"Ownership percentage of {sub_name} (%)",
-            min_value=0.0,
-            max_value=100.0,
-            value=100.0,
-            key=f"ownership_{sub_name}"
-        )
-        ownership_percentages[sub_name] = ownership / 100.0  # Convert to decimal
-
-    # Initialize consolidated data
-    consolidated_data = {}
-
-    # Get all sheets present in parent and subsidiaries
-    all_sheets = set(parent_sheets)
-    for sub_data in subsidiaries_data.values():
-        all_sheets.update(sub_data.keys())
-
-    for sheet in all_sheets:
-        # Initialize an empty DataFrame for this sheet
-        consolidated_df = pd.DataFrame()
-
-        # Process parent data
-        if sheet in parent_data:
-            parent_df = parent_data[sheet]
-            consolidated_df = parent_df.copy()
+    with st.form("ownership"):
+        for file in subsidiary_files:
+            sub_name = file.name
+            ownership = st.number_input(
+                f"Ownership percentage of {sub_name} (%)",
+                min_value=0.0,
+                max_value=100.0,
+                value=100.0,
+                key=f"ownership_{sub_name}"
+            )
+            ownership_percentages[sub_name] = ownership / 100.0  # Convert to decimal
+        submitted = st.form_submit_button("Consolidate")
+    if submitted:
+        st.session_state['ownership_submitted'] = True
 
-        # Process subsidiary data
+    if not st.session_state.get('ownership_submitted'):
+        st.info("Enter the ownership percentages and click Consolidate.")
+    else:
+        st.header("Processing and Consolidating Data...")
+
+        # Per-file status output is only rendered on request
+        debug = st.sidebar.checkbox("Show diagnostics", value=False)
+        if debug:
+            for file in subsidiary_files:
+                st.write(f"Processing subsidiary: {file.name}")
+
+        # Parsed workbooks are kept in the session by content digest, so reruns
+        # reuse them directly and identical uploads (even under different names)
+        # are only parsed once
+        uploads = [parent_file, *subsidiary_files]
+        digests = [hashlib.blake2b(file.getvalue(), digest_size=16).hexdigest() for file in uploads]
+        parsed_workbooks = st.session_state.get('workbooks', {})
+        pending = {digest: file for digest, file in zip(digests, uploads) if digest not in parsed_workbooks}
+        if pending:
+            # Read new files concurrently. Only calamine's sheet load releases the
+            # GIL, so that part of one workbook overlaps with another's conversion
+            # to Python objects and DataFrames, which holds it (as does the whole
+            # openpyxl fallback). A single progress bar is updated as each one finishes
+            progress = st.progress(0.0, text="Reading workbooks...")
+            with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+                futures = {executor.submit(read_workbook, file.getvalue()): digest for digest, file in pending.items()}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    parsed_workbooks[futures[future]] = future.result()
+                    progress.progress(done / len(futures), text=f"Read {done} of {len(futures)} workbooks")
+            progress.empty()
+        # Only keep the workbooks that are still uploaded
+        st.session_state['workbooks'] = {digest: parsed_workbooks[digest] for digest in digests}
+        workbooks = [parsed_workbooks[digest] for digest in digests]
+
+        parent_data = workbooks[0]
+        parent_sheets = list(parent_data)
+        subsidiaries_data = {file.name: data for file, data in zip(subsidiary_files, workbooks[1:])}
+
+        # Initialize consolidated data
+        consolidated_data = {}
+
+        # Map each sheet to the subsidiaries that have it, so each sheet only
+        # visits the subsidiaries it needs
+        sheet_to_subs = defaultdict(list)
         for sub_name, sub_data in subsidiaries_data.items():
-            if sheet in sub_data:
-                sub_df = sub_data[sheet].copy()
-
-                # Align columns with parent_df
-                sub_df = sub_df.reindex(columns=consolidated_df.columns, fill_value=0)
-
-                # Adjust for ownership percentage
-                numeric_cols = sub_df.select_dtypes(include=[np.number]).columns.tolist()
-                sub_df[numeric_cols] = sub_df[numeric_cols] * ownership_percentages[sub_name]
-
-                # Append to consolidated_df
-                consolidated_df = pd.concat([consolidated_df, sub_df], ignore_index=True)
-
-        if not consolidated_df.empty:
-            # Identify key column(s) for grouping
-            possible_keys = ['Account Code', 'Account Name', 'GL Code']
-            key_cols = [col for col in possible_keys if col in consolidated_df.columns]
-            if key_cols:
-                group_by_cols = key_cols
-            else:
-                # Use all non-numeric columns as keys
-                group_by_cols = consolidated_df.select_dtypes(exclude=[np.number]).columns.tolist()
-
-            # Sum numeric data
-            consolidated_df = consolidated_df.groupby(group_by_cols, as_index=False).sum()
+            for sheet in sub_data:
+                sheet_to_subs[sheet].append(sub_name)
 
-            # Eliminate inter-company transactions
-            intercompany_keywords = ['Intercompany', 'Inter-company', 'IC']
-            pattern = '|'.join(intercompany_keywords)
-            intercompany_filter = consolidated_df.apply(
-                lambda row: row.astype(str).str.contains(pattern, case=False, na=False).any(), axis=1
+        # Subsidiary data is aligned to the parent's columns, so only the parent's
+        # sheets have anything to consolidate into
+        for sheet in parent_sheets:
+            # Process parent data
+            parent_df = parent_data[sheet]
+            if parent_df.columns.empty:
+                continue
+
+            sub_names = sheet_to_subs[sheet]
+            consolidated_df = consolidate_sheet(
+                parent_df,
+                [subsidiaries_data[sub_name][sheet] for sub_name in sub_names],
+                [ownership_percentages[sub_name] for sub_name in sub_names],
             )
-            consolidated_df = consolidated_df[~intercompany_filter]
-
-            # Store the consolidated data for this sheet, rename 'H Ltd' to 'HC Ltd' if necessary
-            final_sheet_name = 'HC Ltd' if sheet == 'H Ltd' else sheet
-            consolidated_data[final_sheet_name] = consolidated_df
 
-    if consolidated_data:
-        # Prepare consolidated Excel file for download
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            for sheet_name, df in consolidated_data.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-        processed_data = output.getvalue()
+            if not consolidated_df.empty:
+                # Store the consolidated data for this sheet, rename 'H Ltd' to 'HC Ltd' if necessary
+                final_sheet_name = 'HC Ltd' if sheet == 'H Ltd' else sheet
+                consolidated_data[final_sheet_name] = consolidated_df
 
-        st.success("Consolidation Completed")
-        st.download_button(
-            label="Download Consolidated Excel File",
-            data=processed_data,
-            file_name="Consolidated_Financial_Statements.xlsx"
-        )
-    else:
-        st.error("No data to consolidate.")
+        if consolidated_data:
+            st.success("Consolidation Completed")
+            download_section(consolidated_data)
+        else:
+            st.error("No data to consolidate.")
 
 else:
     st.info("Please upload both parent and subsidiary company Excel files.")
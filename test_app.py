@@ -0,0 +1,88 @@
+import zipfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import consolidate_sheet, write_columnar_archive
+
+
+def frame(**columns):
+    # Build a sheet the way read_workbook returns it, with Arrow-backed columns
+    return pd.DataFrame(columns).convert_dtypes(dtype_backend='pyarrow')
+
+
+def amounts(consolidated_df, key='Item', column='Amount'):
+    return consolidated_df.set_index(key)[column].astype(float).to_dict()
+
+
+def test_blank_subsidiary_cell_counts_as_zero():
+    parent = frame(Item=['Cash', 'Stock'], Amount=[100.0, 5.0])
+    sub1 = frame(Item=['Cash', 'Stock'], Amount=[np.nan, 2.0])
+    sub2 = frame(Item=['Cash', 'Stock'], Amount=[40.0, 4.0])
+
+    result = consolidate_sheet(parent, [sub1, sub2], [0.5, 0.5])
+
+    assert amounts(result) == pytest.approx({'Cash': 120.0, 'Stock': 8.0})
+
+
+def test_header_only_parent_sheet_is_weighted():
+    parent = pd.DataFrame(columns=['Item', 'Amount'])
+    sub = frame(Item=['Cash'], Amount=[3.0])
+
+    result = consolidate_sheet(parent, [sub], [0.6])
+
+    assert amounts(result) == pytest.approx({'Cash': 1.8})
+
+
+def test_numpy_backed_frames_are_weighted():
+    parent = pd.DataFrame({'Item': ['Cash', 'Stock'], 'Amount': [100.0, 5.0]})
+    sub = pd.DataFrame({'Item': ['Cash', 'Stock'], 'Amount': [40.0, 4.0]})
+
+    result = consolidate_sheet(parent, [sub], [0.5])
+
+    assert amounts(result) == pytest.approx({'Cash': 120.0, 'Stock': 7.0})
+
+
+def test_text_value_columns_are_concatenated():
+    parent = frame(**{'Account Name': ['Cash', 'Stock'], 'Desc': ['a', 'b'], 'Amount': [100.0, 5.0]})
+    sub = frame(**{'Account Name': ['Cash'], 'Desc': ['c'], 'Amount': [40.0]})
+
+    result = consolidate_sheet(parent, [sub], [0.5]).set_index('Account Name')
+
+    assert result['Desc'].to_dict() == {'Cash': 'ac', 'Stock': 'b'}
+    assert result['Amount'].astype(float).to_dict() == pytest.approx({'Cash': 120.0, 'Stock': 5.0})
+
+
+def test_keys_mixing_numbers_and_text():
+    parent = frame(**{'Account Code': [1001, 'A-2'], 'Amount': [100.0, 5.0]})
+    sub1 = frame(**{'Account Code': [1001, 'A-2'], 'Amount': [40.0, 4.0]})
+    sub2 = frame(**{'Account Code': [1001, 'A-2'], 'Amount': [20.0, 2.0]})
+
+    result = consolidate_sheet(parent, [sub1, sub2], [0.5, 0.5])
+
+    assert amounts(result, key='Account Code') == pytest.approx({1001: 130.0, 'A-2': 8.0})
+
+
+def test_numeric_parent_keys_with_text_subsidiary_keys():
+    parent = frame(**{'GL Code': [1001, 1002], 'Balance': [100.0, 5.0]})
+    sub = frame(**{'GL Code': ['A-1', 'A-2'], 'Balance': [40.0, 4.0]})
+
+    result = consolidate_sheet(parent, [sub], [0.5])
+
+    assert amounts(result, key='GL Code', column='Balance') == pytest.approx(
+        {1001: 100.0, 1002: 5.0, 'A-1': 20.0, 'A-2': 2.0}
+    )
+
+
+@pytest.mark.parametrize('file_format', ['parquet', 'feather'])
+def test_columnar_archive_writes_mixed_object_columns(file_format):
+    sheet = pd.DataFrame({'Year': [2024, 'Year end'], 'Amount': [1.5, 2.5]})
+
+    archive = zipfile.ZipFile(BytesIO(write_columnar_archive({'Notes': sheet}, file_format)))
+    read = pd.read_parquet if file_format == 'parquet' else pd.read_feather
+    result = read(BytesIO(archive.read(f'Notes.{file_format}')))
+
+    assert result['Year'].tolist() == ['2024', 'Year end']
+    assert result['Amount'].tolist() == [1.5, 2.5]